@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Idempotencia por evento S3 (entregas duplicadas)
+-------------------------------------------------
+
+Las notificaciones de S3 son "at-least-once": el mismo objeto puede llegar más de una vez.
+Antes de descargar nada, `lambda_handler` toma un marcador con clave (bucket, key, ETag, sequencer):
+  * Si nadie lo tenía, procesa y guarda la respuesta en el marcador (COMPLETADO).
+  * Si ya está COMPLETADO, devuelve la respuesta guardada sin procesar.
+  * Si está EN_CURSO, espera a que termine la primera ejecución y reutiliza su respuesta. Si la
+    espera se agota (`IDEMPOTENCY_WAIT_SECONDS`, acotado por el tiempo que le queda a la propia
+    invocación) lanza `EventoEnCurso`, para que Lambda cuente un error y reintente el evento.
+Si el procesamiento falla, el marcador se borra para que un reintento pueda volver a correr.
+
+El marcador EN_CURSO guarda el plazo de su dueño (`time.time()` + tiempo restante de la invocación).
+Pasado ese plazo, el dueño ya fue cortado por el timeout de Lambda y el marcador se considera vencido,
+así los reintentos asíncronos de Lambda (1 y 3 minutos después) reprocesan el evento.
+
+Cada marcador tiene un token de propiedad (ETag en S3, id del propietario en archivo/memoria).
+Reemplazarlo o borrarlo es condicional a ese token, así una ejecución vencida que termina tarde
+(o dos esperas que ven el mismo marcador vencido) no pisan ni borran el marcador de otro dueño.
+
+Stores disponibles (`IDEMPOTENCY_STORE`):
+  * `s3` (producción, default): put condicional (`If-None-Match: *`, `If-Match`) en
+    `IDEMPOTENCY_BUCKET`/`IDEMPOTENCY_PREFIX`. Requiere permisos s3:GetObject, s3:PutObject y
+    s3:DeleteObject sobre ese prefijo, y conviene una regla de lifecycle que expire los marcadores.
+  * `archivo`: un archivo por clave en `IDEMPOTENCY_DIR` (creación exclusiva + flock)
+  * `memoria`: dict en proceso (tests)
+  * `ninguno`: desactivado
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger("ocr_lambda")
+
+EN_CURSO = "EN_CURSO"
+COMPLETADO = "COMPLETADO"
+
+IDEMPOTENCY_STORE = os.environ.get("IDEMPOTENCY_STORE", "s3").lower()
+IDEMPOTENCY_BUCKET = os.environ.get("IDEMPOTENCY_BUCKET", os.environ.get("DICCIONARIO_BUCKET", "medicamentos-output-tesismma"))
+IDEMPOTENCY_PREFIX = os.environ.get("IDEMPOTENCY_PREFIX", "idempotencia/")
+IDEMPOTENCY_DIR = os.environ.get("IDEMPOTENCY_DIR", "/tmp/idempotencia")
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "300"))
+IDEMPOTENCY_POLL_SECONDS = float(os.environ.get("IDEMPOTENCY_POLL_SECONDS", "1.0"))
+# Vencimiento de un marcador EN_CURSO cuando el dueño no informó su plazo (fuera de Lambda)
+IDEMPOTENCY_STALE_SECONDS = float(os.environ.get("IDEMPOTENCY_STALE_SECONDS", "900"))
+# Tiempo que se reserva al final de la invocación para cortar la espera y lanzar el error
+IDEMPOTENCY_MARGIN_SECONDS = float(os.environ.get("IDEMPOTENCY_MARGIN_SECONDS", "5"))
+
+
+class EventoEnCurso(RuntimeError):
+    """El mismo evento sigue en proceso en otra invocación y la espera se agotó."""
+
+
+def clave_evento(record: dict) -> str:
+    """Clave estable de un record S3: hash de bucket, key, ETag y sequencer."""
+    s3_info = record.get("s3", {})
+    obj = s3_info.get("object", {})
+    partes = [
+        s3_info.get("bucket", {}).get("name", ""),
+        obj.get("key", ""),
+        obj.get("eTag", ""),
+        obj.get("sequencer", ""),
+    ]
+    return hashlib.sha256("|".join(partes).encode("utf-8")).hexdigest()
+
+
+# =============================
+# STORES
+# =============================
+# Interfaz común:
+#   crear(clave, registro) -> token | None      (None si ya existía)
+#   leer(clave) -> (registro, token) | None
+#   reemplazar(clave, registro, token) -> bool  (sólo si el marcador sigue teniendo ese token)
+#   borrar(clave, token) -> bool                (ídem)
+
+class MemoryStore:
+    """Store en memoria del proceso. Útil para tests y para un único contenedor."""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def crear(self, clave, registro):
+        with self._lock:
+            if clave in self._datos:
+                return None
+            token = uuid.uuid4().hex
+            self._datos[clave] = (dict(registro), token)
+            return token
+
+    def leer(self, clave):
+        with self._lock:
+            actual = self._datos.get(clave)
+            return (dict(actual[0]), actual[1]) if actual is not None else None
+
+    def reemplazar(self, clave, registro, token) -> bool:
+        with self._lock:
+            actual = self._datos.get(clave)
+            if actual is None or actual[1] != token:
+                return False
+            self._datos[clave] = (dict(registro), uuid.uuid4().hex)
+            return True
+
+    def borrar(self, clave, token) -> bool:
+        with self._lock:
+            actual = self._datos.get(clave)
+            if actual is None or actual[1] != token:
+                return False
+            del self._datos[clave]
+            return True
+
+
+class LocalFileStore:
+    """Un archivo JSON por clave.
+
+    La creación es atómica entre procesos (se escribe un temporal y se enlaza con `os.link`, que
+    falla si ya existe). Reemplazar/borrar comparan el token bajo un `flock` por clave.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+
+    def _path(self, clave):
+        return os.path.join(self.directorio, f"{clave}.json")
+
+    def _escribir_temporal(self, clave, registro, token):
+        tmp = f"{self._path(clave)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"token": token, "registro": registro}, f)
+        return tmp
+
+    def _bloqueo(self, clave):
+        f = open(f"{self._path(clave)}.lock", "a")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def crear(self, clave, registro):
+        token = uuid.uuid4().hex
+        tmp = self._escribir_temporal(clave, registro, token)
+        try:
+            os.link(tmp, self._path(clave))
+            return token
+        except FileExistsError:
+            return None
+        finally:
+            os.remove(tmp)
+
+    def leer(self, clave):
+        try:
+            with open(self._path(clave), "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except FileNotFoundError:
+            return None
+        return datos["registro"], datos["token"]
+
+    def reemplazar(self, clave, registro, token) -> bool:
+        with self._bloqueo(clave):
+            actual = self.leer(clave)
+            if actual is None or actual[1] != token:
+                return False
+            os.replace(self._escribir_temporal(clave, registro, uuid.uuid4().hex), self._path(clave))
+            return True
+
+    def borrar(self, clave, token) -> bool:
+        with self._bloqueo(clave):
+            actual = self.leer(clave)
+            if actual is None or actual[1] != token:
+                return False
+            os.remove(self._path(clave))
+            return True
+
+
+class S3Store:
+    """Marcadores en S3. Creación con `IfNoneMatch='*'`; reemplazo y borrado con `IfMatch=<ETag>`."""
+
+    CONFLICTOS = ("PreconditionFailed", "ConditionalRequestConflict", "NoSuchKey", "404")
+
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = boto3.client("s3")
+
+    def _key(self, clave):
+        return f"{self.prefix}{clave}.json"
+
+    def _body(self, registro):
+        # El id de propietario garantiza un ETag distinto aunque el contenido se repita
+        return json.dumps({"propietario": uuid.uuid4().hex, "registro": registro}).encode("utf-8")
+
+    def _es_conflicto(self, error):
+        return error.response.get("Error", {}).get("Code") in self.CONFLICTOS
+
+    def crear(self, clave, registro):
+        try:
+            resp = self.s3.put_object(Bucket=self.bucket, Key=self._key(clave),
+                                      Body=self._body(registro), IfNoneMatch="*")
+            return resp["ETag"]
+        except ClientError as e:
+            if self._es_conflicto(e):
+                return None
+            raise
+
+    def leer(self, clave):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self._key(clave))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(obj["Body"].read())["registro"], obj["ETag"]
+
+    def reemplazar(self, clave, registro, token) -> bool:
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=self._key(clave), Body=self._body(registro), IfMatch=token)
+            return True
+        except ClientError as e:
+            if self._es_conflicto(e):
+                return False
+            raise
+
+    def borrar(self, clave, token) -> bool:
+        try:
+            self.s3.delete_object(Bucket=self.bucket, Key=self._key(clave), IfMatch=token)
+            return True
+        except ClientError as e:
+            if self._es_conflicto(e):
+                return False
+            raise
+
+
+# =============================
+# COORDINACIÓN
+# =============================
+
+class Idempotencia:
+    def __init__(self, store, espera=IDEMPOTENCY_WAIT_SECONDS, intervalo=IDEMPOTENCY_POLL_SECONDS,
+                 vencimiento=IDEMPOTENCY_STALE_SECONDS, margen=IDEMPOTENCY_MARGIN_SECONDS):
+        self.store = store
+        self.espera = espera
+        self.intervalo = intervalo
+        self.vencimiento = vencimiento
+        self.margen = margen
+
+    def iniciar(self, clave, plazo=None):
+        """Toma el marcador de `clave`.
+
+        `plazo` es el instante (epoch) en que esta invocación va a ser cortada; se guarda en el
+        marcador y acota la espera. Retorna (token, None) si esta invocación es la dueña y debe
+        procesar el evento, o (None, respuesta guardada) si es un duplicado ya resuelto. Lanza
+        `EventoEnCurso` si el evento sigue en proceso al agotarse la espera.
+        """
+        ahora = time.time()
+        if plazo is None:
+            plazo = ahora + self.vencimiento
+        limite = time.monotonic() + min(self.espera, plazo - ahora - self.margen)
+        while True:
+            token = self.store.crear(clave, {"estado": EN_CURSO, "inicio": time.time(), "plazo": plazo})
+            if token is not None:
+                return token, None
+            actual = self.store.leer(clave)
+            if actual is None:
+                # Se liberó entre crear y leer: esperar un poco y volver a intentar
+                time.sleep(self.intervalo)
+                continue
+            registro, token_actual = actual
+            if registro.get("estado") == COMPLETADO:
+                logger.info("Evento duplicado: se reutiliza el resultado ya procesado")
+                return None, registro["resultado"]
+            vence = registro.get("plazo", registro.get("inicio", 0) + self.vencimiento)
+            if time.time() > vence:
+                # Sólo el primero que borra ese marcador exacto lo toma; los demás vuelven a esperar
+                if self.store.borrar(clave, token_actual):
+                    logger.warning("Marcador de idempotencia vencido, se descarta y se reprocesa")
+                continue
+            if time.monotonic() >= limite:
+                raise EventoEnCurso("Evento duplicado todavía en curso tras la espera máxima")
+            time.sleep(self.intervalo)
+
+    def completar(self, clave, token, respuesta):
+        """Guarda la respuesta si fue exitosa; si no, libera el marcador para permitir reintentos."""
+        if respuesta.get("statusCode") == 200:
+            registro = {"estado": COMPLETADO, "fin": time.time(), "resultado": respuesta}
+            if not self.store.reemplazar(clave, registro, token):
+                logger.warning("El marcador de idempotencia cambió de dueño; no se guarda el resultado")
+        else:
+            self.liberar(clave, token)
+
+    def liberar(self, clave, token):
+        if not self.store.borrar(clave, token):
+            logger.warning("El marcador de idempotencia cambió de dueño; no se libera")
+
+
+def crear_idempotencia_desde_entorno():
+    """Instancia la capa según `IDEMPOTENCY_STORE`. Retorna None si está desactivada."""
+    if IDEMPOTENCY_STORE == "s3":
+        return Idempotencia(S3Store(IDEMPOTENCY_BUCKET, IDEMPOTENCY_PREFIX))
+    if IDEMPOTENCY_STORE == "archivo":
+        return Idempotencia(LocalFileStore(IDEMPOTENCY_DIR))
+    if IDEMPOTENCY_STORE == "memoria":
+        return Idempotencia(MemoryStore())
+    if IDEMPOTENCY_STORE in ("", "ninguno", "none"):
+        return None
+    raise RuntimeError(f"IDEMPOTENCY_STORE desconocido: {IDEMPOTENCY_STORE}")
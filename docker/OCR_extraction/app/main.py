@@ -19,7 +19,11 @@ Requisitos del usuario:
   * Extracción robusta de MM/AAAA (con fallback a DD/MM/AAAA si está disponible)
   * Actualizar el último CSV en `RESULTS_PREFIX` seteando la columna "Fecha de vencimiento"
 
-NOTA: El flujo de MEDICAMENTO se mantiene sin cambios funcionales respecto al primer archivo.
+NOTA: El flujo de MEDICAMENTO mantiene la extracción, la regla ULTRADIM y el matching del primer archivo;
+lo nuevo es la cascada de modelos y las columnas "Modelo" y "ETag Diccionario" del CSV.
+
+Ambos flujos usan la cascada `TOGETHER_MODEL_CASCADE`: el primer intento va al modelo más chico y cada
+intento sin match (o sin fecha válida) escala al siguiente. El nivel que resolvió se informa en la respuesta.
 """
 import os
 import json
@@ -27,6 +31,7 @@ import re
 import base64
 import tempfile
 import boto3
+from botocore.exceptions import ClientError
 import pandas as pd
 import csv
 import time
@@ -35,6 +40,9 @@ from pathlib import Path
 from datetime import datetime
 from unidecode import unidecode
 
+from idempotencia import EventoEnCurso, clave_evento, crear_idempotencia_desde_entorno
+from profiling import perfilar_handler
+
 # Together SDK (igual que en el primer script)
 try:
     from together import Together
@@ -50,9 +58,16 @@ except Exception:
     _has_lev = False
 
 # =============================
-# CONFIGURACIÓN (sin cambios)
+# CONFIGURACIÓN
 # =============================
 MODEL_NAME = os.environ.get("TOGETHER_MODEL", "meta-llama/Llama-3.2-90B-Vision-Instruct-Turbo")
+# Cascada de modelos (del más barato/rápido al más grande), separados por coma.
+# Se arranca por el primero y se escala un nivel por cada intento que no da resultado.
+MODEL_CASCADE = [
+    m.strip()
+    for m in os.environ.get("TOGETHER_MODEL_CASCADE", f"meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo,{MODEL_NAME}").split(",")
+    if m.strip()
+] or [MODEL_NAME]
 DICCIONARIO_BUCKET = os.environ.get("DICCIONARIO_BUCKET", "medicamentos-output-tesismma")
 DICCIONARIO_KEY = os.environ.get("DICCIONARIO_KEY", "diccionarios/diccionario_medicamentos.csv")
 RESULTS_PREFIX = os.environ.get("RESULTS_PREFIX", "resultados/")
@@ -79,6 +94,9 @@ getDatePrompt = (
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger("ocr_lambda")
 
+# Capa de idempotencia (una por contenedor; None si IDEMPOTENCY_STORE=ninguno)
+IDEMPOTENCIA = crear_idempotencia_desde_entorno()
+
 # =============================
 # HELPERS COMUNES
 # =============================
@@ -117,11 +135,17 @@ def encode_image(image_path: str) -> str:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
 
+def modelo_para_intento(intento: int):
+    """Devuelve (nivel, modelo) de la cascada para el intento `intento` (base 0). Nivel base 1."""
+    idx = min(intento, len(MODEL_CASCADE) - 1)
+    return idx + 1, MODEL_CASCADE[idx]
+
+
 # =============================
-# FLUJO MEDICAMENTO (SIN CAMBIOS)
+# FLUJO MEDICAMENTO
 # =============================
 
-def procesar_imagen_stream(client, image_path, prompt, max_retries=MAX_RETRIES):
+def procesar_imagen_stream(client, image_path, prompt, max_retries=MAX_RETRIES, model=MODEL_NAME):
     """Igual que en el primer script: hace streaming con retry/backoff y concatena el contenido."""
     attempt = 0
     last_exc = None
@@ -129,7 +153,7 @@ def procesar_imagen_stream(client, image_path, prompt, max_retries=MAX_RETRIES):
         try:
             base64_image = encode_image(image_path)
             stream = client.chat.completions.create(
-                model=MODEL_NAME,
+                model=model,
                 messages=[{
                     "role": "user",
                     "content": [
@@ -151,9 +175,10 @@ def procesar_imagen_stream(client, image_path, prompt, max_retries=MAX_RETRIES):
         except Exception as e:
             last_exc = e
             logger.warning(f"Intento {attempt+1}/{max_retries} falló: {e}")
-            sleep_for = (RETRY_BACKOFF_BASE ** attempt) + (0.1 * attempt)
-            time.sleep(min(sleep_for, 30))
             attempt += 1
+            if attempt < max_retries:  # Sin espera después del último intento
+                sleep_for = (RETRY_BACKOFF_BASE ** (attempt - 1)) + (0.1 * (attempt - 1))
+                time.sleep(min(sleep_for, 30))
     raise RuntimeError(f"Fallo tras {max_retries} intentos. Último error: {last_exc}")
 
 
@@ -177,7 +202,8 @@ def levenshtein_score(a, b):
     return 1.0 / (1.0 + dist)
 
 
-def cargar_diccionario_desde_s3(bucket_name, diccionario_key):
+def cargar_diccionario_con_etag(bucket_name, diccionario_key):
+    """Descarga el diccionario y devuelve (DataFrame, ETag) para poder registrar contra qué versión se matcheó."""
     s3 = boto3.client("s3")
     logger.info(f"Descargando diccionario desde s3://{bucket_name}/{diccionario_key}")
     obj = s3.get_object(Bucket=bucket_name, Key=diccionario_key)
@@ -185,42 +211,62 @@ def cargar_diccionario_desde_s3(bucket_name, diccionario_key):
     if "Input" not in df.columns:
         raise RuntimeError("El diccionario no contiene la columna 'Input'.")
     df["Input"] = df["Input"].apply(normalize_text)
-    return df
+    return df, obj.get("ETag", "").strip('"')
 
 
-def find_medication_info(extracted_text, medication_df):
-    extracted_text_norm = normalize_text(extracted_text)
-    extracted_words = set(extracted_text_norm.split())
+def cargar_diccionario_desde_s3(bucket_name, diccionario_key):
+    df, _ = cargar_diccionario_con_etag(bucket_name, diccionario_key)
+    return df
 
-    exact_matches = medication_df[medication_df["Input"] == extracted_text_norm]
-    if not exact_matches.empty:
-        row = exact_matches.iloc[0]
-        return row.get("Nombre del medicamento", ""), row.get("Dosis", "")
 
-    best_match_name = ""
-    best_match_dose = ""
-    best_score = float("-inf")
+def aplica_regla_ultradim(texto_extraido):
+    """Regla ULTRADIM (idéntica al primer script) sobre el texto extraído en mayúsculas."""
+    return any(token in texto_extraido for token in ["ULTRADIM", "ULTRADIN", "ULTRA DIM", "ULTRA DIN"])
 
-    for _, row in medication_df.iterrows():
-        candidate = row["Input"]
-        candidate_words = set(candidate.split())
 
-        if extracted_text_norm == candidate:
-            return row.get("Nombre del medicamento", ""), row.get("Dosis", "")
+def find_medication_info(extracted_text, medication_df):
+    """Matchea un texto contra el diccionario (exacto, o Levenshtein + overlap de palabras)."""
+    return find_medication_info_batch([extracted_text], medication_df)[0]
 
-        word_overlap_score = len(extracted_words.intersection(candidate_words))
-        lev_score = levenshtein_score(extracted_text_norm, candidate)
-        combined_score = word_overlap_score * 1.5 + lev_score * 5.0
 
-        if combined_score > best_score:
-            best_score = combined_score
-            best_match_name = row.get("Nombre del medicamento", "")
-            best_match_dose = row.get("Dosis", "")
+def find_medication_info_batch(extracted_texts, medication_df, cache=None):
+    """Matching por lotes; `find_medication_info` es el caso de un solo texto.
 
-    if best_score > 1:
-        return best_match_name, best_match_dose
-    else:
-        return "No encontrado", ""
+    Match exacto contra "Input" si existe; si no, el mejor puntaje overlap * 1.5 + Levenshtein * 5.0
+    (desempate: el primero del diccionario), siempre que supere 1. Prepara los candidatos una sola vez
+    y matchea cada texto normalizado distinto una sola vez. `cache` (dict) permite reutilizar los
+    matches entre lotes contra el mismo diccionario.
+    Devuelve una lista de (nombre, dosis) alineada con `extracted_texts`.
+    """
+    nombres = medication_df.get("Nombre del medicamento", pd.Series([""] * len(medication_df))).tolist()
+    dosis = medication_df.get("Dosis", pd.Series([""] * len(medication_df))).tolist()
+    candidatos = [
+        (candidate, set(candidate.split()), nombre, dosis_)
+        for candidate, nombre, dosis_ in zip(medication_df["Input"].tolist(), nombres, dosis)
+    ]
+    exactos = {}
+    for candidate, _, nombre, dosis_ in candidatos:
+        exactos.setdefault(candidate, (nombre, dosis_))
+
+    if cache is None:
+        cache = {}
+    resultados = []
+    for text in extracted_texts:
+        text_norm = normalize_text(text)
+        if text_norm not in cache:
+            if text_norm in exactos:
+                cache[text_norm] = exactos[text_norm]
+            else:
+                words = set(text_norm.split())
+                best, best_score = ("No encontrado", ""), float("-inf")
+                for candidate, candidate_words, nombre, dosis_ in candidatos:
+                    combined_score = len(words.intersection(candidate_words)) * 1.5 + levenshtein_score(text_norm, candidate) * 5.0
+                    if combined_score > best_score:
+                        best_score = combined_score
+                        best = (nombre, dosis_)
+                cache[text_norm] = best if best_score > 1 else ("No encontrado", "")
+        resultados.append(cache[text_norm])
+    return resultados
 
 
 def upload_result_csv(bucket, base_name, df_result):
@@ -246,12 +292,37 @@ def is_fec_vec_key(key: str) -> bool:
     return base.endswith("-fec-vec")
 
 
-def procesar_imagen_stream_once(client, image_path, prompt):
+def motivo_para_ignorar(record, key):
+    """Devuelve el motivo por el que `lambda_handler` ignora el evento, o None si hay que procesarlo."""
+    # Ignorar eventos generados por la propia Lambda (igual que primer script)
+    if "Lambda" in record.get("userIdentity", {}).get("principalId", ""):
+        return "Evento generado por Lambda ignorado"
+    # Solo procesar carpeta convertidas/
+    if not key.startswith("convertidas/"):
+        return f"Archivo fuera de carpeta ignorado: {key}"
+    if os.path.splitext(key)[1].lower() not in [".jpg", ".jpeg", ".png"]:
+        return f"Ignorado archivo no imagen: {key}"
+    return None
+
+
+def flujo_de_evento(event):
+    """Nombre del flujo ('fec-vec' o 'medicamento') que va a seguir un evento S3.
+
+    Devuelve None para los eventos que `lambda_handler` ignora (ver `motivo_para_ignorar`).
+    """
+    record = event["Records"][0]
+    key = record["s3"]["object"]["key"]
+    if motivo_para_ignorar(record, key) is not None:
+        return None
+    return "fec-vec" if is_fec_vec_key(key) else "medicamento"
+
+
+def procesar_imagen_stream_once(client, image_path, prompt, model=MODEL_NAME):
     """Un solo stream (sin backoff). Se usa para múltiples intentos controlados en fec-vec."""
     try:
         base64_image = encode_image(image_path)
         stream = client.chat.completions.create(
-            model=MODEL_NAME,
+            model=model,
             messages=[{
                 "role": "user",
                 "content": [
@@ -345,8 +416,22 @@ def extract_dd_mm_yyyy(text: str) -> str:
     return m.group(0) if m else ""
 
 
+# Timestamp que `upload_result_csv` agrega a la clave: <base>_YYYYmmdd-HHMMSS.csv
+_RESULT_TS_RE = re.compile(r"_(\d{8}-\d{6})\.csv$", re.IGNORECASE)
+
+
+def _orden_resultado(obj) -> tuple:
+    """Orden de creación de un CSV de resultados: timestamp de la clave y, si no tiene, LastModified.
+
+    No depende sólo de LastModified porque reescribir un CSV (re-matching, fecha de vencimiento)
+    lo actualiza y haría que un resultado viejo pase a ser "el último".
+    """
+    m = _RESULT_TS_RE.search(obj["Key"])
+    return (m.group(1) if m else "", obj["LastModified"])
+
+
 def get_latest_csv_key(bucket: str, prefix: str = RESULTS_PREFIX) -> str:
-    """Obtiene el último CSV (por LastModified) bajo `prefix` en `bucket` (maneja paginación)."""
+    """Obtiene el último CSV creado (según el timestamp de la clave) bajo `prefix` en `bucket` (maneja paginación)."""
     s3 = boto3.client("s3")
     continuation_token = None
     newest = None
@@ -360,7 +445,7 @@ def get_latest_csv_key(bucket: str, prefix: str = RESULTS_PREFIX) -> str:
             key = obj["Key"]
             if not key.lower().endswith(".csv"):
                 continue
-            if (newest is None) or (obj["LastModified"] > newest["LastModified"]):
+            if (newest is None) or (_orden_resultado(obj) > _orden_resultado(newest)):
                 newest = obj
         if resp.get("IsTruncated"):
             continuation_token = resp.get("NextContinuationToken")
@@ -371,25 +456,44 @@ def get_latest_csv_key(bucket: str, prefix: str = RESULTS_PREFIX) -> str:
     return newest["Key"]
 
 
-def update_csv_expiry(bucket: str, key: str, expiry_value: str) -> None:
-    """Actualiza/crea la columna 'Fecha de vencimiento' en el CSV y setea el valor en la fila 0."""
+def reescribir_csv_condicional(bucket: str, key: str, modificar, max_intentos: int = 5) -> bool:
+    """Lee el CSV, aplica `modificar(df)` y lo sube sólo si nadie lo cambió en el medio (IfMatch con el ETag leído).
+
+    `modificar` devuelve el DataFrame a escribir, o None si no hay cambios. Ante un conflicto se vuelve
+    a leer y a aplicar sobre el contenido nuevo. Retorna True si escribió.
+    """
     s3 = boto3.client("s3")
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    df = pd.read_csv(obj["Body"], dtype=str).fillna("")
+    for intento in range(max_intentos):
+        obj = s3.get_object(Bucket=bucket, Key=key)
+        df = modificar(pd.read_csv(obj["Body"], dtype=str).fillna(""))
+        if df is None:
+            return False
+        body = df.to_csv(index=False, quoting=csv.QUOTE_ALL).encode("utf-8-sig")
+        try:
+            s3.put_object(Bucket=bucket, Key=key, Body=body, IfMatch=obj["ETag"])
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise
+            logger.info(f"s3://{bucket}/{key} cambió durante la actualización, reintentando ({intento+1}/{max_intentos})")
+    raise RuntimeError(f"No se pudo actualizar s3://{bucket}/{key}: modificado concurrentemente {max_intentos} veces.")
+
 
-    # Asegurar columna por nombre (mejor que por índice)
-    if "Fecha de vencimiento" not in df.columns:
-        df["Fecha de vencimiento"] = ""
+def update_csv_expiry(bucket: str, key: str, expiry_value: str) -> None:
+    """Actualiza/crea la columna 'Fecha de vencimiento' en el CSV y setea el valor en la fila 0."""
+    def setear_fecha(df):
+        # Asegurar columna por nombre (mejor que por índice)
+        if "Fecha de vencimiento" not in df.columns:
+            df["Fecha de vencimiento"] = ""
 
-    if df.shape[0] < 1:
-        # Si por alguna razón está vacío, creamos una fila
-        df.loc[0, :] = ""
+        if df.shape[0] < 1:
+            # Si por alguna razón está vacío, creamos una fila
+            df.loc[0, :] = ""
 
-    df.loc[0, "Fecha de vencimiento"] = expiry_value
+        df.loc[0, "Fecha de vencimiento"] = expiry_value
+        return df
 
-    tmp_out = "/tmp/actualizado.csv"
-    df.to_csv(tmp_out, index=False, encoding="utf-8-sig", quoting=csv.QUOTE_ALL)
-    s3.upload_file(Filename=tmp_out, Bucket=bucket, Key=key)
+    reescribir_csv_condicional(bucket, key, setear_fecha)
     logger.info(f"CSV actualizado en s3://{bucket}/{key} (Fecha de vencimiento='{expiry_value}')")
 
 
@@ -400,6 +504,8 @@ def fec_vec_flow(client, image_path: str) -> dict:
         'fecha_obtenida': <str>,
         'ocr_text': <str>,
         'intentos': <int>,
+        'modelo': <str>,
+        'nivel_modelo': <int>,
         'csv_actualizado_key': <str or None>
     }
     """
@@ -408,9 +514,11 @@ def fec_vec_flow(client, image_path: str) -> dict:
     fecha_mm_yyyy = "No encontrada"
 
     intentos = 0
+    nivel_modelo, modelo = modelo_para_intento(0)
     for attempt in range(5):  # Igual que Colab: hasta 5 intentos
         intentos = attempt + 1
-        raw = procesar_imagen_stream_once(client, image_path, getDatePrompt)
+        nivel_modelo, modelo = modelo_para_intento(attempt)
+        raw = procesar_imagen_stream_once(client, image_path, getDatePrompt, model=modelo)
         if raw:
             ocr_text = raw
             # Primero, intentar fecha completa DD/MM/YYYY
@@ -442,10 +550,13 @@ def fec_vec_flow(client, image_path: str) -> dict:
         logger.warning(f"No se pudo actualizar el último CSV: {e}")
         latest_key = None
 
+    logger.info(f"Flujo fec-vec finalizado: fecha='{fecha_para_csv}' intentos={intentos} nivel_modelo={nivel_modelo} modelo={modelo}")
     return {
         "fecha_obtenida": fecha_para_csv,
         "ocr_text": ocr_text,
         "intentos": intentos,
+        "modelo": modelo,
+        "nivel_modelo": nivel_modelo,
         "csv_actualizado_key": latest_key,
     }
 
@@ -454,6 +565,7 @@ def fec_vec_flow(client, image_path: str) -> dict:
 # LAMBDA HANDLER (COMBINADO)
 # =============================
 
+@perfilar_handler(flujo_de_evento)
 def lambda_handler(event, context):
     logger.info("Evento recibido")
 
@@ -466,22 +578,52 @@ def lambda_handler(event, context):
         logger.error(f"Evento no es S3: {e}")
         return {"statusCode": 400, "body": "Evento inválido"}
 
-    # Ignorar eventos generados por la propia Lambda (igual que primer script)
-    user_identity = record.get("userIdentity", {}).get("principalId", "")
-    if "Lambda" in user_identity:
-        logger.info("Evento generado por Lambda, ignorando")
-        return {"statusCode": 200, "body": "Evento generado por Lambda ignorado"}
-
-    # Solo procesar carpeta convertidas/
-    if not key.startswith("convertidas/"):
-        logger.info(f"Ignorando archivo fuera de convertidas/: {key}")
-        return {"statusCode": 200, "body": "Archivo fuera de carpeta ignorado"}
+    motivo = motivo_para_ignorar(record, key)
+    if motivo is not None:
+        logger.info(motivo)
+        return {"statusCode": 200, "body": motivo}
 
     ext = os.path.splitext(key)[1].lower()
-    if ext not in [".jpg", ".jpeg", ".png"]:
-        logger.info(f"Ignorado archivo no imagen: {key}")
-        return {"statusCode": 200, "body": f"Ignorado archivo no imagen: {key}"}
 
+    # --- Idempotencia: cortar entregas duplicadas antes de descargar ---
+    clave_idem = None
+    token_idem = None
+    if IDEMPOTENCIA is not None:
+        plazo = None
+        if hasattr(context, "get_remaining_time_in_millis"):
+            plazo = time.time() + context.get_remaining_time_in_millis() / 1000
+        try:
+            clave_idem = clave_evento(record)
+            token_idem, previo = IDEMPOTENCIA.iniciar(clave_idem, plazo)
+        except EventoEnCurso:
+            # Error a propósito: Lambda reintenta el evento en vez de darlo por procesado
+            logger.warning("Evento duplicado todavía en curso, se devuelve error para que Lambda reintente")
+            raise
+        except Exception as e:
+            logger.warning(f"Idempotencia no disponible, se procesa igual: {e}")
+            token_idem, previo = None, None
+        if previo is not None:
+            return previo
+
+    try:
+        respuesta = procesar_objeto(bucket, key, ext)
+    except Exception:
+        if token_idem is not None:
+            try:
+                IDEMPOTENCIA.liberar(clave_idem, token_idem)
+            except Exception as e:
+                logger.warning(f"No se pudo liberar el marcador de idempotencia: {e}")
+        raise
+    if token_idem is not None:
+        try:
+            IDEMPOTENCIA.completar(clave_idem, token_idem, respuesta)
+        except Exception as e:
+            logger.warning(f"No se pudo registrar el resultado en idempotencia: {e}")
+    return respuesta
+
+
+def procesar_objeto(bucket, key, ext):
+    """Descarga la imagen y ejecuta el flujo que corresponda (fec-vec o medicamento)."""
     # --- Descargar imagen temporalmente ---
     s3 = boto3.client("s3")
     tmp_file_path = None
@@ -517,6 +659,8 @@ def lambda_handler(event, context):
                 "mensaje": "Fecha de vencimiento procesada",
                 "fecha_obtenida": result["fecha_obtenida"],
                 "intentos": result["intentos"],
+                "modelo": result["modelo"],
+                "nivel_modelo": result["nivel_modelo"],
                 "s3_result_key": result["csv_actualizado_key"],
             }
             return {"statusCode": 200, "body": json.dumps(body)}
@@ -531,18 +675,19 @@ def lambda_handler(event, context):
                 pass
 
     # =============================
-    # BRANCH: MEDICAMENTO (SIN CAMBIOS)
+    # BRANCH: MEDICAMENTO
     # =============================
     try:
         extracted_text = ""
         retry_count = 0
+        nivel_modelo, modelo = modelo_para_intento(retry_count)
         nombre = "No encontrado"
         dosis = ""
         base_name = os.path.splitext(os.path.basename(key))[0]
 
         # Cargar diccionario una sola vez
         try:
-            diccionario_medicamentos = cargar_diccionario_desde_s3(DICCIONARIO_BUCKET, DICCIONARIO_KEY)
+            diccionario_medicamentos, diccionario_etag = cargar_diccionario_con_etag(DICCIONARIO_BUCKET, DICCIONARIO_KEY)
         except Exception as e:
             logger.error(f"No se pudo cargar diccionario: {e}")
             return {"statusCode": 500, "body": f"No se pudo cargar diccionario: {e}"}
@@ -554,11 +699,18 @@ def lambda_handler(event, context):
             "Nombre del medicamento": "",
             "Dosis": "",
             "Fecha de vencimiento": "",
+            "Modelo": "",
+            "ETag Diccionario": diccionario_etag,
         }
 
         while retry_count < MAX_RETRIES:
+            nivel_modelo, modelo = modelo_para_intento(retry_count)
+            df_out_row["Modelo"] = modelo
             try:
-                raw_text = procesar_imagen_stream(client, tmp_file_path, getDescriptionPrompt)
+                # Los niveles intermedios no reintentan con backoff: ante un error se escala al siguiente
+                reintentos = MAX_RETRIES if nivel_modelo == len(MODEL_CASCADE) else 1
+                raw_text = procesar_imagen_stream(client, tmp_file_path, getDescriptionPrompt,
+                                                  max_retries=reintentos, model=modelo)
             except Exception as e:
                 logger.warning(f"Intento {retry_count+1} - error al procesar imagen: {e}")
                 raw_text = ""
@@ -568,7 +720,7 @@ def lambda_handler(event, context):
             df_out_row["Nombre Normalizado"] = normalize_text(raw_text)
 
             # Regla ULTRADIM (idéntica al primer script)
-            if any(token in df_out_row["Texto extraído"] for token in ["ULTRADIM", "ULTRADIN", "ULTRA DIM", "ULTRA DIN"]):
+            if aplica_regla_ultradim(df_out_row["Texto extraído"]):
                 nombre = "Nopucid ULTRADIM"
                 dosis = ""
                 df_out_row["Nombre del medicamento"] = nombre
@@ -583,7 +735,7 @@ def lambda_handler(event, context):
                 dosis = dosis_match
                 df_out_row["Nombre del medicamento"] = nombre
                 df_out_row["Dosis"] = dosis
-                logger.info(f"Matching exitoso en intento {retry_count+1}: {nombre} / {dosis}")
+                logger.info(f"Matching exitoso en intento {retry_count+1} (modelo {modelo}): {nombre} / {dosis}")
                 break
 
             retry_count += 1
@@ -595,6 +747,10 @@ def lambda_handler(event, context):
             df_out_row["Nombre del medicamento"] = "No encontrado"
             df_out_row["Dosis"] = ""
 
+        logger.info(
+            f"Flujo medicamento finalizado: nombre='{df_out_row['Nombre del medicamento']}' "
+            f"nivel_modelo={nivel_modelo} modelo={modelo}"
+        )
         df_result = pd.DataFrame([df_out_row])
         s3_key_out = upload_result_csv(DICCIONARIO_BUCKET, base_name, df_result)
 
@@ -604,6 +760,8 @@ def lambda_handler(event, context):
                 "nombre_extraido": df_out_row["Nombre Extraído"],
                 "nombre_medicamento": df_out_row["Nombre del medicamento"],
                 "dosis": df_out_row["Dosis"],
+                "modelo": modelo,
+                "nivel_modelo": nivel_modelo,
                 "s3_result_key": s3_key_out,
             }),
         }
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Profiling opcional del handler en producción (cProfile + tracemalloc)
+----------------------------------------------------------------------
+
+Se activa por variables de entorno (leídas una sola vez al importar):
+  * `PROFILING_ENABLED=1`: perfila todas las invocaciones
+  * `PROFILING_SAMPLE_RATE=0.05`: perfila una fracción de las invocaciones (tiene prioridad)
+  * `PROFILING_OUTPUT`: `s3://bucket/prefijo/` o un directorio local (default `/tmp/profiles`)
+  * `PROFILING_TOP_ALLOCS`: cantidad de sitios de asignación a reportar (default 25)
+
+Por cada invocación perfilada se escriben `<flujo>/<request_id>.prof` (abrible con `pstats` o
+snakeviz) y `<flujo>/<request_id>.txt` (funciones más costosas y top de asignaciones de memoria).
+
+Si está desactivado, `perfilar_handler` devuelve el handler original: cero overhead. Un valor
+inválido en `PROFILING_SAMPLE_RATE` se loguea y deja el profiling desactivado; uno inválido en
+`PROFILING_TOP_ALLOCS` se loguea y se usa el default. Los eventos para los que `clasificar_flujo`
+devuelve None (los que el handler ignora) no se perfilan.
+"""
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import random
+import shutil
+import tracemalloc
+
+import boto3
+
+logger = logging.getLogger("ocr_lambda")
+
+
+def _tasa_muestreo() -> float:
+    tasa = os.environ.get("PROFILING_SAMPLE_RATE")
+    if tasa:
+        try:
+            return max(0.0, min(1.0, float(tasa)))
+        except ValueError:
+            logger.warning(f"PROFILING_SAMPLE_RATE inválido ({tasa!r}), profiling desactivado")
+            return 0.0
+    return 1.0 if os.environ.get("PROFILING_ENABLED", "").lower() in ("1", "true", "yes") else 0.0
+
+
+def _top_asignaciones() -> int:
+    valor = os.environ.get("PROFILING_TOP_ALLOCS") or "25"
+    try:
+        return max(0, int(valor.strip()))
+    except ValueError:
+        logger.warning(f"PROFILING_TOP_ALLOCS inválido ({valor!r}), se usa 25")
+        return 25
+
+
+PROFILING_SAMPLE_RATE = _tasa_muestreo()
+PROFILING_OUTPUT = os.environ.get("PROFILING_OUTPUT", "/tmp/profiles")
+PROFILING_TOP_ALLOCS = _top_asignaciones()
+
+
+def perfilar_handler(clasificar_flujo):
+    """Decorador para `lambda_handler`. `clasificar_flujo(event)` devuelve el nombre del flujo, o None si no se perfila."""
+    def decorador(handler):
+        if PROFILING_SAMPLE_RATE <= 0:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if random.random() >= PROFILING_SAMPLE_RATE:
+                return handler(event, context)
+            try:
+                flujo = clasificar_flujo(event)
+            except Exception:
+                flujo = None
+            if flujo is None:
+                return handler(event, context)
+            return _ejecutar_perfilado(handler, event, context, flujo)
+
+        return wrapper
+
+    return decorador
+
+
+def _ejecutar_perfilado(handler, event, context, flujo):
+    request_id = getattr(context, "aws_request_id", None) or "local"
+
+    trazando = tracemalloc.is_tracing()
+    if not trazando:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return handler(event, context)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, pico = tracemalloc.get_traced_memory()
+        if not trazando:
+            tracemalloc.stop()
+        try:
+            _guardar_perfil(profiler, snapshot, pico, request_id, flujo)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar el perfil de {request_id}: {e}")
+
+
+def _reporte_texto(profiler, snapshot, pico, request_id, flujo) -> str:
+    out = io.StringIO()
+    out.write(f"request_id={request_id} flujo={flujo} pico_memoria_traceada={pico / 1024 / 1024:.1f} MiB\n\n")
+    out.write("=== Funciones por tiempo acumulado ===\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+    out.write(f"\n=== Top {PROFILING_TOP_ALLOCS} sitios de asignación ===\n")
+    filtros = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+    for stat in snapshot.filter_traces(filtros).statistics("lineno")[:PROFILING_TOP_ALLOCS]:
+        out.write(f"{stat}\n")
+    return out.getvalue()
+
+
+def _guardar_perfil(profiler, snapshot, pico, request_id, flujo):
+    texto = _reporte_texto(profiler, snapshot, pico, request_id, flujo)
+    prof_local = f"/tmp/{request_id}.prof"
+    profiler.dump_stats(prof_local)
+
+    if PROFILING_OUTPUT.startswith("s3://"):
+        bucket, _, prefix = PROFILING_OUTPUT[len("s3://"):].partition("/")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        base_key = f"{prefix}{flujo}/{request_id}"
+        s3 = boto3.client("s3")
+        s3.upload_file(Filename=prof_local, Bucket=bucket, Key=f"{base_key}.prof")
+        s3.put_object(Bucket=bucket, Key=f"{base_key}.txt", Body=texto.encode("utf-8"), ContentType="text/plain")
+        os.remove(prof_local)
+        logger.info(f"Perfil subido a s3://{bucket}/{base_key}.(prof|txt)")
+    else:
+        destino = os.path.join(PROFILING_OUTPUT, flujo)
+        os.makedirs(destino, exist_ok=True)
+        shutil.move(prof_local, os.path.join(destino, f"{request_id}.prof"))
+        with open(os.path.join(destino, f"{request_id}.txt"), "w", encoding="utf-8") as f:
+            f.write(texto)
+        logger.info(f"Perfil guardado en {destino}/{request_id}.(prof|txt)")
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Re-matching incremental de resultados contra el diccionario (SIN llamadas al modelo)
+-------------------------------------------------------------------------------------
+
+Cuando se actualiza el diccionario, los CSV de `RESULTS_PREFIX` ya tienen el texto OCR en
+"Nombre Normalizado". Este job:
+  * Descarga el diccionario vigente y su ETag
+  * Lee un manifiesto (`REMATCH_MANIFEST_KEY`, JSON fuera de `RESULTS_PREFIX`) con el ETag de
+    diccionario contra el que ya se re-matcheó cada CSV, y sólo descarga los que no están al día.
+    Una corrida sin cambios cuesta un LIST y un GET del manifiesto.
+  * Re-matchea cada CSV pendiente (`find_medication_info_batch`, con caché compartida entre CSV),
+    respetando la regla ULTRADIM
+  * Reescribe el CSV sólo si alguna fila cambió, con escritura condicional (IfMatch) para no pisar
+    una "Fecha de vencimiento" escrita en paralelo; las filas cambiadas registran el ETag nuevo
+    en la columna "ETag Diccionario"
+
+El manifiesto se guarda cada `REMATCH_GUARDAR_CADA` CSV y, como Lambda, la corrida corta cuando
+quedan menos de `REMATCH_MARGEN_SEGUNDOS` de tiempo; la próxima corrida sigue desde ahí. Se escribe
+con put condicional (IfMatch / IfNoneMatch): si otra corrida lo cambió, se relee y se vuelven a
+aplicar encima los CSV procesados por esta.
+
+Se puede disparar como Lambda (con el evento S3 de subida del diccionario y una regla programada
+para retomar corridas cortadas, usando `rematch.lambda_handler` como handler de la misma imagen)
+o por línea de comandos. En Lambda conviene concurrencia reservada = 1 para que las corridas no
+se solapen.
+"""
+import argparse
+import json
+import os
+
+import boto3
+from botocore.exceptions import ClientError
+
+from main import (
+    DICCIONARIO_BUCKET,
+    DICCIONARIO_KEY,
+    RESULTS_PREFIX,
+    aplica_regla_ultradim,
+    cargar_diccionario_con_etag,
+    find_medication_info_batch,
+    logger,
+    reescribir_csv_condicional,
+)
+
+REMATCH_MANIFEST_KEY = os.environ.get("REMATCH_MANIFEST_KEY", "rematch/manifest.json")
+REMATCH_GUARDAR_CADA = int(os.environ.get("REMATCH_GUARDAR_CADA", "50"))
+REMATCH_MARGEN_SEGUNDOS = float(os.environ.get("REMATCH_MARGEN_SEGUNDOS", "60"))
+ETAG_COLUMN = "ETag Diccionario"
+NOMBRE_ULTRADIM = "Nopucid ULTRADIM"
+
+
+def listar_csv_resultados(s3, bucket: str, prefix: str = RESULTS_PREFIX) -> list:
+    """Lista las claves .csv bajo `prefix` (maneja paginación)."""
+    keys = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].lower().endswith(".csv"):
+                keys.append(obj["Key"])
+    return keys
+
+
+def leer_manifiesto(s3, bucket: str, key: str):
+    """Devuelve ({clave CSV: ETag del diccionario con el que se re-matcheó}, ETag del manifiesto o None)."""
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return {}, None
+        raise
+    return json.loads(obj["Body"].read()).get("resultados", {}), obj["ETag"]
+
+
+def guardar_manifiesto(s3, bucket: str, key: str, resultados: dict, etag_manifiesto, vigentes: list,
+                       procesados: dict, max_intentos: int = 5):
+    """Escribe el manifiesto sólo si no cambió desde `etag_manifiesto` (None: si todavía no existe).
+
+    Si otra corrida lo modificó, se relee y se aplican `procesados` encima de su versión (podando
+    las claves que no están en `vigentes`). Retorna (resultados escritos, ETag nuevo).
+    """
+    vigentes = set(vigentes)
+    for intento in range(max_intentos):
+        body = json.dumps({"resultados": resultados}, ensure_ascii=False, indent=1).encode("utf-8")
+        condicion = {"IfMatch": etag_manifiesto} if etag_manifiesto else {"IfNoneMatch": "*"}
+        try:
+            resp = s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType="application/json", **condicion)
+            return resultados, resp["ETag"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise
+            logger.info(f"El manifiesto cambió durante la corrida, se combina ({intento+1}/{max_intentos})")
+        remoto, etag_manifiesto = leer_manifiesto(s3, bucket, key)
+        resultados = {k: v for k, v in remoto.items() if k in vigentes}
+        resultados.update(procesados)
+    raise RuntimeError(f"No se pudo guardar el manifiesto s3://{bucket}/{key} tras {max_intentos} intentos")
+
+
+def rematch_csv(bucket: str, key: str, diccionario, etag: str, cache: dict, dry_run: bool = False) -> int:
+    """Re-matchea un CSV y lo reescribe sólo si alguna fila cambió. Retorna las filas cambiadas."""
+    cambiadas = 0
+
+    def rematchear(df):
+        nonlocal cambiadas
+        cambiadas = 0
+        if "Nombre Normalizado" not in df.columns:
+            logger.warning(f"{key} no tiene 'Nombre Normalizado', se omite")
+            return None
+        for col in ("Texto extraído", "Nombre del medicamento", "Dosis", ETAG_COLUMN):
+            if col not in df.columns:
+                df[col] = ""
+        matches = find_medication_info_batch(df["Nombre Normalizado"].tolist(), diccionario, cache)
+        for idx, (nombre, dosis) in zip(df.index, matches):
+            if aplica_regla_ultradim(df.at[idx, "Texto extraído"]):
+                nombre, dosis = NOMBRE_ULTRADIM, ""
+            if (df.at[idx, "Nombre del medicamento"], df.at[idx, "Dosis"]) != (nombre, dosis):
+                logger.info(f"{key} fila {idx}: '{df.at[idx, 'Nombre del medicamento']}' -> '{nombre}'")
+                df.at[idx, "Nombre del medicamento"] = nombre
+                df.at[idx, "Dosis"] = dosis
+                df.at[idx, ETAG_COLUMN] = etag
+                cambiadas += 1
+        if cambiadas == 0 or dry_run:
+            return None
+        return df
+
+    reescribir_csv_condicional(bucket, key, rematchear)
+    return cambiadas
+
+
+def rematch_resultados(bucket: str = DICCIONARIO_BUCKET, prefix: str = RESULTS_PREFIX,
+                       diccionario_key: str = DICCIONARIO_KEY, manifest_key: str = REMATCH_MANIFEST_KEY,
+                       dry_run: bool = False, segundos_restantes=None) -> dict:
+    """Re-matchea los CSV pendientes contra la versión actual del diccionario.
+
+    `segundos_restantes` (callable, opcional) devuelve el tiempo que le queda a la corrida; si baja
+    de `REMATCH_MARGEN_SEGUNDOS` se guarda el progreso y se corta. Retorna un resumen con la cantidad
+    de CSV revisados, omitidos (ya al día), actualizados, filas cuyo match cambió y CSV que quedaron
+    pendientes para la próxima corrida.
+    """
+    s3 = boto3.client("s3")
+    diccionario, etag = cargar_diccionario_con_etag(bucket, diccionario_key)
+    logger.info(f"Re-matching contra diccionario ETag={etag}")
+
+    manifiesto, etag_manifiesto = leer_manifiesto(s3, bucket, manifest_key)
+    keys = listar_csv_resultados(s3, bucket, prefix)
+    # Se descartan del manifiesto los CSV que ya no existen
+    nuevo_manifiesto = {k: manifiesto[k] for k in keys if k in manifiesto}
+    pendientes = [k for k in keys if manifiesto.get(k) != etag]
+    guardado = manifiesto
+    procesados = {}
+
+    def guardar():
+        nonlocal nuevo_manifiesto, etag_manifiesto, guardado
+        if dry_run or nuevo_manifiesto == guardado:
+            return
+        nuevo_manifiesto, etag_manifiesto = guardar_manifiesto(
+            s3, bucket, manifest_key, nuevo_manifiesto, etag_manifiesto, keys, procesados)
+        guardado = dict(nuevo_manifiesto)
+
+    cache = {}
+    filas_cambiadas = 0
+    csv_actualizados = 0
+    sin_guardar = 0
+    restantes = 0
+    for i, key in enumerate(pendientes):
+        if segundos_restantes is not None and segundos_restantes() < REMATCH_MARGEN_SEGUNDOS:
+            restantes = len(pendientes) - i
+            logger.info(f"Tiempo casi agotado, quedan {restantes} CSV para la próxima corrida")
+            break
+        try:
+            cambiadas = rematch_csv(bucket, key, diccionario, etag, cache, dry_run)
+        except Exception as e:
+            logger.warning(f"No se pudo re-matchear {key}: {e}")
+            continue
+        procesados[key] = etag
+        nuevo_manifiesto[key] = etag
+        filas_cambiadas += cambiadas
+        if cambiadas and not dry_run:
+            csv_actualizados += 1
+        sin_guardar += 1
+        if sin_guardar >= REMATCH_GUARDAR_CADA:
+            guardar()
+            sin_guardar = 0
+
+    guardar()
+
+    resumen = {
+        "diccionario_etag": etag,
+        "csv_revisados": len(keys),
+        "csv_omitidos": len(keys) - len(pendientes),
+        "csv_actualizados": csv_actualizados,
+        "filas_cambiadas": filas_cambiadas,
+        "csv_restantes": restantes,
+        "dry_run": dry_run,
+    }
+    logger.info(f"Re-matching finalizado: {resumen}")
+    return resumen
+
+
+def lambda_handler(event, context):
+    try:
+        segundos_restantes = None
+        if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+            segundos_restantes = lambda: context.get_remaining_time_in_millis() / 1000
+        resumen = rematch_resultados(dry_run=bool((event or {}).get("dry_run", False)),
+                                     segundos_restantes=segundos_restantes)
+        return {"statusCode": 200, "body": json.dumps(resumen)}
+    except Exception as e:
+        logger.exception(f"Error en re-matching: {e}")
+        return {"statusCode": 500, "body": f"Error en re-matching: {e}"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-matchea los resultados guardados contra el diccionario vigente.")
+    parser.add_argument("--bucket", default=DICCIONARIO_BUCKET)
+    parser.add_argument("--prefix", default=RESULTS_PREFIX)
+    parser.add_argument("--diccionario-key", default=DICCIONARIO_KEY)
+    parser.add_argument("--manifest-key", default=REMATCH_MANIFEST_KEY)
+    parser.add_argument("--dry-run", action="store_true", help="Calcula los cambios sin escribir en S3.")
+    args = parser.parse_args()
+    print(json.dumps(rematch_resultados(args.bucket, args.prefix, args.diccionario_key,
+                                        args.manifest_key, args.dry_run), indent=2))
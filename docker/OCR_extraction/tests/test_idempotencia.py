@@ -0,0 +1,111 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from idempotencia import EN_CURSO, EventoEnCurso, Idempotencia, LocalFileStore, MemoryStore, S3Store  # noqa: E402
+
+OK = {"statusCode": 200, "body": "procesado"}
+
+
+@pytest.fixture(params=["memoria", "archivo", "s3"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "memoria":
+        yield MemoryStore()
+    elif request.param == "archivo":
+        yield LocalFileStore(str(tmp_path))
+    else:
+        moto = pytest.importorskip("moto")
+        for var in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+            monkeypatch.setenv(var, "test")
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+        monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
+        with moto.mock_aws():
+            import boto3
+            boto3.client("s3").create_bucket(Bucket="idempotencia-test")
+            yield S3Store("idempotencia-test", "idempotencia/")
+
+
+def test_duplicado_reutiliza_resultado(store):
+    idem = Idempotencia(store, espera=1, intervalo=0.01)
+    token, previo = idem.iniciar("clave")
+    assert token is not None and previo is None
+    idem.completar("clave", token, OK)
+
+    assert idem.iniciar("clave") == (None, OK)
+
+
+def test_duplicado_en_curso_espera_al_primero(store):
+    idem = Idempotencia(store, espera=5, intervalo=0.01)
+    token, _ = idem.iniciar("clave")
+    resultado = {}
+    espera = threading.Thread(target=lambda: resultado.update(r=idem.iniciar("clave")))
+    espera.start()
+    time.sleep(0.1)
+    assert espera.is_alive()
+    idem.completar("clave", token, OK)
+    espera.join(timeout=5)
+
+    assert resultado["r"] == (None, OK)
+
+
+def test_falla_libera_el_marcador(store):
+    idem = Idempotencia(store, espera=1, intervalo=0.01)
+    token, _ = idem.iniciar("clave")
+    idem.completar("clave", token, {"statusCode": 500, "body": "error"})
+
+    token, previo = idem.iniciar("clave")
+    assert token is not None and previo is None
+
+
+def test_marcador_vencido_lo_toma_un_solo_dueño(store):
+    idem = Idempotencia(store, espera=0.3, intervalo=0.01, vencimiento=60)
+    token_viejo = store.crear("clave", {"estado": EN_CURSO, "inicio": time.time() - 120})
+
+    resultados = []
+
+    def tomar():
+        try:
+            resultados.append(idem.iniciar("clave"))
+        except EventoEnCurso:
+            resultados.append((None, None))
+
+    hilos = [threading.Thread(target=tomar) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(timeout=5)
+
+    dueños = [token for token, _ in resultados if token is not None]
+    assert len(dueños) == 1
+    assert len(resultados) == 4
+
+    # La ejecución vencida que termina tarde no pisa ni libera el marcador del nuevo dueño
+    idem.completar("clave", token_viejo, OK)
+    idem.liberar("clave", token_viejo)
+    registro, token_actual = store.leer("clave")
+    assert registro["estado"] == EN_CURSO
+    assert token_actual == dueños[0]
+
+
+def test_marcador_con_plazo_vencido_se_reprocesa(store):
+    # El dueño fue cortado por el timeout de Lambda: el reintento no espera el vencimiento fijo
+    idem = Idempotencia(store, espera=1, intervalo=0.01, vencimiento=900)
+    store.crear("clave", {"estado": EN_CURSO, "inicio": time.time() - 5, "plazo": time.time() - 1})
+
+    token, previo = idem.iniciar("clave", plazo=time.time() + 60)
+    assert token is not None and previo is None
+
+
+def test_espera_acotada_por_el_plazo_propio_lanza_error(store):
+    idem = Idempotencia(store, espera=300, intervalo=0.01, margen=0)
+    idem.iniciar("clave", plazo=time.time() + 60)
+
+    t0 = time.monotonic()
+    with pytest.raises(EventoEnCurso):
+        idem.iniciar("clave", plazo=time.time() + 0.2)
+    assert time.monotonic() - t0 < 2
@@ -4,30 +4,65 @@ import os
 from PIL import Image
 import pillow_heif
 
-# Cliente de S3
+# Cliente de S3 (compartido por ambos flujos)
 s3 = boto3.client("s3")
 
 OUTPUT_BUCKET = "medicamentos-output-tesismma"
 FRIENDLY_EXTENSIONS = [".jpg", ".jpeg", ".png", ".gif", ".bmp"]
+FEC_VEC_EXTENSIONS = [".jpg", ".jpeg"]
 
-def convert_heic_to_jpg(bucket_name, object_key):
-    heic_filename = os.path.basename(object_key)
-    local_heic_path = f"/tmp/{heic_filename}"
-    s3.download_file(bucket_name, object_key, local_heic_path)
-    
+# Ruteo al flujo "-fec-vec": por atributo del evento, prefijo de subida o bucket de origen
+FLUJO_FEC_VEC = "fec-vec"
+FLUJO_MEDICAMENTO = "medicamento"
+FEC_VEC_PREFIXES = [p for p in os.environ.get("FEC_VEC_PREFIXES", "fec-vec/").split(",") if p]
+FEC_VEC_BUCKETS = [b for b in os.environ.get("FEC_VEC_BUCKETS", "").split(",") if b]
+
+
+def detectar_flujo(event, bucket_name, object_key):
+    """Decide si el archivo va por el flujo de medicamento o por el de fecha de vencimiento."""
+    flujo = event.get("flujo") if isinstance(event, dict) else None
+    if flujo in (FLUJO_FEC_VEC, FLUJO_MEDICAMENTO):
+        return flujo
+    if bucket_name in FEC_VEC_BUCKETS:
+        return FLUJO_FEC_VEC
+    if any(object_key.startswith(prefix) for prefix in FEC_VEC_PREFIXES):
+        return FLUJO_FEC_VEC
+    return FLUJO_MEDICAMENTO
+
+
+def nombre_salida(filename, flujo):
+    base_name = os.path.splitext(filename)[0]
+    if flujo == FLUJO_FEC_VEC:
+        return f"{base_name}-fec-vec.jpg"
+    return f"{base_name}.jpg"
+
+
+def upload_to_both_buckets(local_path, bucket_name, new_s3_key, extra_args=None):
+    s3.upload_file(local_path, bucket_name, new_s3_key, ExtraArgs=extra_args)
+    s3.upload_file(local_path, OUTPUT_BUCKET, new_s3_key, ExtraArgs=extra_args)
+
+
+def decode_heic(local_heic_path):
     heif_file = pillow_heif.open_heif(local_heic_path)
-    image = Image.frombytes(
+    return Image.frombytes(
         heif_file.mode, heif_file.size, heif_file.data,
         "raw", heif_file.mode, heif_file.stride
     )
-    
-    jpg_filename = os.path.splitext(heic_filename)[0] + ".jpg"
+
+
+def convert_heic_to_jpg(bucket_name, object_key, flujo=FLUJO_MEDICAMENTO):
+    heic_filename = os.path.basename(object_key)
+    local_heic_path = f"/tmp/{heic_filename}"
+    s3.download_file(bucket_name, object_key, local_heic_path)
+
+    image = decode_heic(local_heic_path)
+
+    jpg_filename = nombre_salida(heic_filename, flujo)
     local_jpg_path = f"/tmp/{jpg_filename}"
     image.save(local_jpg_path, "JPEG", quality=95)
 
     new_s3_key = f"convertidas/{jpg_filename}"
-    s3.upload_file(local_jpg_path, bucket_name, new_s3_key, ExtraArgs={'ContentType': 'image/jpeg'})
-    s3.upload_file(local_jpg_path, OUTPUT_BUCKET, new_s3_key, ExtraArgs={'ContentType': 'image/jpeg'})
+    upload_to_both_buckets(local_jpg_path, bucket_name, new_s3_key, {'ContentType': 'image/jpeg'})
 
     return new_s3_key
 
@@ -37,8 +72,17 @@ def move_friendly_image(bucket_name, object_key):
     s3.download_file(bucket_name, object_key, local_path)
 
     new_s3_key = f"convertidas/{filename}"
-    s3.upload_file(local_path, bucket_name, new_s3_key)
-    s3.upload_file(local_path, OUTPUT_BUCKET, new_s3_key)
+    upload_to_both_buckets(local_path, bucket_name, new_s3_key)
+
+    return new_s3_key
+
+def process_jpg(bucket_name, object_key):
+    jpg_filename = os.path.basename(object_key)
+    local_jpg_path = f"/tmp/{jpg_filename}"
+    s3.download_file(bucket_name, object_key, local_jpg_path)
+
+    new_s3_key = f"convertidas/{nombre_salida(jpg_filename, FLUJO_FEC_VEC)}"
+    upload_to_both_buckets(local_jpg_path, bucket_name, new_s3_key, {'ContentType': 'image/jpeg'})
 
     return new_s3_key
 
@@ -47,7 +91,7 @@ def lambda_handler(event, context):
         record = event["Records"][0]
         bucket_name = record["s3"]["bucket"]["name"]
         object_key = record["s3"]["object"]["key"]
-        
+
         # Ignorar archivos dentro de 'convertidas/' para evitar loops
         if object_key.startswith("convertidas/"):
             return {
@@ -55,10 +99,30 @@ def lambda_handler(event, context):
                 "body": json.dumps("Ignorado: archivo en carpeta convertidas.")
             }
 
+        flujo = detectar_flujo(event, bucket_name, object_key)
         ext = os.path.splitext(object_key)[1].lower()
-        
+
+        if flujo == FLUJO_FEC_VEC:
+            if ext == ".heic":
+                new_file = convert_heic_to_jpg(bucket_name, object_key, flujo)
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps(f"Conversión HEIC completada: {new_file}")
+                }
+            elif ext in FEC_VEC_EXTENSIONS:
+                new_file = process_jpg(bucket_name, object_key)
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps(f"Procesamiento JPG completado: {new_file}")
+                }
+            else:
+                return {
+                    "statusCode": 400,
+                    "body": json.dumps("Formato de archivo no soportado (solo HEIC/JPG)")
+                }
+
         if ext == ".heic":
-            new_file = convert_heic_to_jpg(bucket_name, object_key)
+            new_file = convert_heic_to_jpg(bucket_name, object_key, flujo)
             return {
                 "statusCode": 200,
                 "body": json.dumps(f"Conversión completada: {new_file}")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servidor falso de chat-completions (streaming) compatible con el SDK de Together
+---------------------------------------------------------------------------------
+
+Responde `POST /v1/chat/completions` con eventos SSE (`data: {...}`) igual que la API real,
+de modo que `main.lambda_handler` funcione sin cambios apuntando `TOGETHER_BASE_URL` acá.
+
+Parámetros configurables:
+  * `ttft`: segundos hasta el primer token
+  * `tokens_por_segundo`: ritmo de emisión del resto de los tokens
+  * `tasa_error`: fracción de requests que responden HTTP 500
+  * `tasa_miss_por_modelo`: por modelo, fracción de respuestas sin texto útil (para probar la cascada)
+
+Cuenta las llamadas por flujo (medicamento / fec-vec, según el prompt) y por modelo.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# El prompt del flujo FECHA es el único que pide fechas (ver getDatePrompt en main.py)
+MARCA_PROMPT_FECHA = "You should be finding dates."
+
+
+class FakeTogetherServer:
+    def __init__(self, host="127.0.0.1", port=0, ttft=0.3, tokens_por_segundo=50.0, tasa_error=0.0,
+                 texto_medicamento="IBUPROFENO 400 MG", texto_fecha="LOTE 1234 VTO 05/2027",
+                 tasa_miss_por_modelo=None, seed=None):
+        self.ttft = ttft
+        self.tokens_por_segundo = tokens_por_segundo
+        self.tasa_error = tasa_error
+        self.texto_medicamento = texto_medicamento
+        self.texto_fecha = texto_fecha
+        self.tasa_miss_por_modelo = dict(tasa_miss_por_modelo or {})
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.llamadas_por_flujo = Counter()
+        self.llamadas_por_modelo = Counter()
+        self.errores_por_flujo = Counter()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "llamadas_por_flujo": dict(self.llamadas_por_flujo),
+                "errores_por_flujo": dict(self.errores_por_flujo),
+                "llamadas_por_modelo": dict(self.llamadas_por_modelo),
+            }
+
+    def _registrar(self, flujo, modelo):
+        """Cuenta la llamada y sortea (bajo lock, para que el seed sea reproducible) error y miss."""
+        with self._lock:
+            self.llamadas_por_flujo[flujo] += 1
+            self.llamadas_por_modelo[modelo] += 1
+            falla = self._random.random() < self.tasa_error
+            if falla:
+                self.errores_por_flujo[flujo] += 1
+            miss = self._random.random() < self.tasa_miss_por_modelo.get(modelo, 0.0)
+            return falla, miss
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", "0"))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                modelo = payload.get("model", "")
+                flujo = "fec-vec" if MARCA_PROMPT_FECHA in _texto_prompt(payload) else "medicamento"
+
+                falla, miss = server._registrar(flujo, modelo)
+                if falla:
+                    body = json.dumps({"error": {"message": "Fallo simulado", "type": "server_error"}}).encode()
+                    self.send_response(500)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                if miss:
+                    texto = "No visible text found."
+                else:
+                    texto = server.texto_fecha if flujo == "fec-vec" else server.texto_medicamento
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+
+                completion_id = f"fake-{uuid.uuid4().hex}"
+                time.sleep(server.ttft)
+                tokens = re.findall(r"\S+\s*|\s+", texto)
+                intervalo = 1.0 / server.tokens_por_segundo if server.tokens_por_segundo > 0 else 0.0
+                for i, token in enumerate(tokens):
+                    if i > 0 and intervalo:
+                        time.sleep(intervalo)
+                    self._enviar_chunk(completion_id, modelo, {"role": "assistant", "content": token}, None)
+                self._enviar_chunk(completion_id, modelo, {"content": ""}, "stop")
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def _enviar_chunk(self, completion_id, modelo, delta, finish_reason):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": modelo,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        return Handler
+
+
+def _texto_prompt(payload):
+    partes = []
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            partes.append(content)
+        elif isinstance(content, list):
+            partes.extend(c.get("text", "") for c in content if isinstance(c, dict) and c.get("type") == "text")
+    return "\n".join(partes)
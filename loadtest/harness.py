@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load test end-to-end del pipeline (conversor HEIC/JPG + OCR) sin AWS ni Together reales
+----------------------------------------------------------------------------------------
+
+- S3: usa un emulador local. Si se pasa `--s3-endpoint` (LocalStack, MinIO, `moto_server`...)
+  se usa ese; si no, se levanta `moto` en proceso (paquete opcional, ver requirements.txt).
+- Together: levanta `fake_together.FakeTogetherServer` y apunta `TOGETHER_BASE_URL` a él.
+- Cada worker es un proceso que importa los handlers una sola vez (como un contenedor Lambda
+  caliente) y atiende un evento a la vez. Por cada imagen sintética se ejecuta el conversor y,
+  con la clave resultante en `convertidas/`, `main.lambda_handler`.
+
+Con `--duplicados` una fracción de los eventos de OCR se entrega dos veces en simultáneo (mismo
+sequencer), para validar la capa de idempotencia (store `archivo` compartido entre workers).
+
+Reporta p50/p95/p99 de latencia, throughput, cantidad de llamadas al modelo por flujo y qué
+nivel de la cascada de modelos resolvió cada evento.
+
+Ejemplo:
+    python loadtest/harness.py --eventos 200 --concurrencia 16 --ttft 0.4 --tokens-por-segundo 40 --tasa-error 0.02
+"""
+import argparse
+import importlib.util
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from fake_together import FakeTogetherServer
+
+# moto es opcional: solo se usa si no se pasa --s3-endpoint
+try:
+    from moto.server import ThreadedMotoServer
+except Exception:
+    ThreadedMotoServer = None
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CONVERTER_PATH = REPO_ROOT / "docker" / "heic-to-jpg" / "lambda_jpg_converter.py"
+OCR_APP_DIR = REPO_ROOT / "docker" / "OCR_extraction" / "app"
+
+INPUT_BUCKET = "loadtest-input"
+OUTPUT_BUCKET = "medicamentos-output-tesismma"  # Fijo en el conversor
+DICCIONARIO_KEY = "diccionarios/diccionario_medicamentos.csv"
+
+ETAPAS = ["conversor", "ocr", "ocr_duplicado", "total"]
+
+# Estado por proceso worker
+_converter = None
+_main = None
+
+
+class FakeContext:
+    def __init__(self, timeout=900):
+        self.aws_request_id = str(uuid.uuid4())
+        self.function_name = "loadtest"
+        self._fin = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._fin - time.time()) * 1000))
+
+
+def _cargar_modulo(nombre, path):
+    spec = importlib.util.spec_from_file_location(nombre, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _init_worker():
+    global _converter, _main
+    sys.path.insert(0, str(OCR_APP_DIR))
+    _converter = _cargar_modulo("lambda_jpg_converter", CONVERTER_PATH)
+    _main = _cargar_modulo("main", OCR_APP_DIR / "main.py")
+
+
+def s3_event(bucket, key, sequencer=None):
+    return {"Records": [{
+        "eventSource": "aws:s3",
+        "eventName": "ObjectCreated:Put",
+        "s3": {"bucket": {"name": bucket},
+               "object": {"key": key, "sequencer": sequencer or uuid.uuid4().hex.upper()}},
+    }]}
+
+
+def _medir_handler(handler, event):
+    t0 = time.perf_counter()
+    resp = handler(event, FakeContext())
+    return resp, time.perf_counter() - t0
+
+
+def _ejecutar_evento(key, duplicado=False):
+    """Corre conversor + OCR para una imagen subida. Se ejecuta dentro de un worker.
+
+    Si `duplicado`, el evento de OCR se entrega dos veces en paralelo, como un reenvío de S3.
+    """
+    resultado = {"key": key, "latencias": {}, "status": {}}
+    t0 = time.perf_counter()
+    resp = _converter.lambda_handler(s3_event(INPUT_BUCKET, key), FakeContext())
+    t1 = time.perf_counter()
+    resultado["latencias"]["conversor"] = t1 - t0
+    resultado["status"]["conversor"] = resp.get("statusCode")
+    if resp.get("statusCode") != 200:
+        resultado["error"] = resp.get("body")
+        return resultado
+
+    converted_key = json.loads(resp["body"]).split(": ", 1)[1]
+    resultado["flujo"] = "fec-vec" if _main.is_fec_vec_key(converted_key) else "medicamento"
+    evento_ocr = s3_event(OUTPUT_BUCKET, converted_key)
+    if duplicado:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            primero = pool.submit(_medir_handler, _main.lambda_handler, evento_ocr)
+            segundo = pool.submit(_medir_handler, _main.lambda_handler, json.loads(json.dumps(evento_ocr)))
+            resp, _ = primero.result()
+            _, resultado["latencias"]["ocr_duplicado"] = segundo.result()
+    else:
+        resp, _ = _medir_handler(_main.lambda_handler, evento_ocr)
+    t2 = time.perf_counter()
+    resultado["latencias"]["ocr"] = t2 - t1
+    resultado["latencias"]["total"] = t2 - t0
+    resultado["status"]["ocr"] = resp.get("statusCode")
+    if resp.get("statusCode") != 200:
+        resultado["error"] = resp.get("body")
+    else:
+        resultado["nivel_modelo"] = json.loads(resp["body"]).get("nivel_modelo")
+    return resultado
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano (valores ya ordenados)."""
+    if not valores:
+        return float("nan")
+    idx = max(0, min(len(valores) - 1, math.ceil(p / 100.0 * len(valores)) - 1))
+    return valores[idx]
+
+
+def preparar_s3(s3, eventos, proporcion_fec_vec, texto_medicamento):
+    from PIL import Image
+
+    for bucket in (INPUT_BUCKET, OUTPUT_BUCKET):
+        s3.create_bucket(Bucket=bucket)
+
+    diccionario = (
+        "Input,Nombre del medicamento,Dosis\n"
+        f"{texto_medicamento},{texto_medicamento.split()[0].title()},{' '.join(texto_medicamento.split()[1:])}\n"
+        "PARACETAMOL 500 MG,Paracetamol,500 MG\n"
+    )
+    s3.put_object(Bucket=OUTPUT_BUCKET, Key=DICCIONARIO_KEY, Body=diccionario.encode("utf-8"))
+
+    buf = io.BytesIO()
+    Image.new("RGB", (640, 480), (255, 255, 255)).save(buf, "JPEG", quality=85)
+    imagen = buf.getvalue()
+
+    keys = []
+    cada = round(1 / proporcion_fec_vec) if proporcion_fec_vec > 0 else 0
+    for i in range(eventos):
+        es_fec_vec = bool(cada) and i % cada == cada - 1
+        key = f"fec-vec/img-{i:05d}.jpg" if es_fec_vec else f"uploads/img-{i:05d}.jpg"
+        s3.put_object(Bucket=INPUT_BUCKET, Key=key, Body=imagen)
+        keys.append(key)
+    return keys
+
+
+def reportar(resultados, duracion, stats_modelo):
+    por_flujo = defaultdict(lambda: defaultdict(list))
+    errores = defaultdict(int)
+    niveles = defaultdict(lambda: defaultdict(int))
+    for r in resultados:
+        flujo = r.get("flujo", "desconocido")
+        if "error" in r:
+            errores[flujo] += 1
+        if r.get("nivel_modelo") is not None:
+            niveles[flujo][r["nivel_modelo"]] += 1
+        for etapa, valor in r["latencias"].items():
+            por_flujo[flujo][etapa].append(valor)
+
+    reporte = {"duracion_s": duracion, "eventos": len(resultados),
+               "throughput_eventos_s": len(resultados) / duracion if duracion else 0.0,
+               "flujos": {}, "modelo": stats_modelo}
+    print(f"\nEventos: {len(resultados)}  Duración: {duracion:.2f}s  Throughput: {reporte['throughput_eventos_s']:.2f} ev/s")
+    print(f"{'flujo':<12}{'etapa':<15}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for flujo in sorted(por_flujo):
+        reporte["flujos"][flujo] = {"errores": errores[flujo],
+                                    "llamadas_modelo": stats_modelo["llamadas_por_flujo"].get(flujo, 0),
+                                    "eventos_por_nivel_modelo": dict(niveles[flujo])}
+        for etapa in ETAPAS:
+            valores = sorted(por_flujo[flujo].get(etapa, []))
+            if not valores:
+                continue
+            p50, p95, p99 = (percentil(valores, p) for p in (50, 95, 99))
+            reporte["flujos"][flujo][etapa] = {"n": len(valores), "p50": p50, "p95": p95, "p99": p99,
+                                               "throughput_s": len(valores) / duracion if duracion else 0.0}
+            print(f"{flujo:<12}{etapa:<15}{len(valores):>6}{p50:>9.3f}{p95:>9.3f}{p99:>9.3f}")
+    print("\nLlamadas al modelo por flujo:", stats_modelo["llamadas_por_flujo"])
+    print("Errores simulados por flujo:", stats_modelo["errores_por_flujo"])
+    print("Llamadas por modelo:", stats_modelo["llamadas_por_modelo"])
+    print("Eventos resueltos por nivel de modelo:", {f: dict(n) for f, n in niveles.items()})
+    print("Eventos con error:", dict(errores))
+    return reporte
+
+
+def _parsear_tasas(valores):
+    tasas = {}
+    for valor in valores:
+        modelo, _, tasa = valor.rpartition("=")
+        if not modelo:
+            raise SystemExit(f"--tasa-miss inválido: {valor!r} (esperado MODELO=TASA)")
+        tasas[modelo] = float(tasa)
+    return tasas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test local del pipeline de OCR.")
+    parser.add_argument("--eventos", type=int, default=50)
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--proporcion-fec-vec", type=float, default=0.5,
+                        help="Fracción de imágenes que van por el flujo -fec-vec.")
+    parser.add_argument("--s3-endpoint", default=None, help="Endpoint S3 local ya levantado (si no, moto en proceso).")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Segundos hasta el primer token.")
+    parser.add_argument("--tokens-por-segundo", type=float, default=50.0)
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Fracción de llamadas que responden 500.")
+    parser.add_argument("--texto-medicamento", default="IBUPROFENO 400 MG")
+    parser.add_argument("--texto-fecha", default="LOTE 1234 VTO 05/2027")
+    parser.add_argument("--tasa-miss", action="append", default=[], metavar="MODELO=TASA",
+                        help="Fracción de respuestas sin texto útil para ese modelo (repetible).")
+    parser.add_argument("--duplicados", type=float, default=0.0,
+                        help="Fracción de eventos de OCR entregados dos veces en simultáneo.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--salida-json", default=None, help="Ruta donde guardar el reporte en JSON.")
+    args = parser.parse_args(argv)
+
+    moto_server = None
+    endpoint = args.s3_endpoint
+    if endpoint is None:
+        if ThreadedMotoServer is None:
+            raise SystemExit("Falta un emulador S3: instalar moto[server] o pasar --s3-endpoint.")
+        moto_server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        moto_server.start()
+        host, port = moto_server.get_host_and_port()
+        endpoint = f"http://{host}:{port}"
+
+    fake = FakeTogetherServer(ttft=args.ttft, tokens_por_segundo=args.tokens_por_segundo,
+                              tasa_error=args.tasa_error, texto_medicamento=args.texto_medicamento,
+                              texto_fecha=args.texto_fecha, seed=args.seed,
+                              tasa_miss_por_modelo=_parsear_tasas(args.tasa_miss)).start()
+
+    # Los workers heredan este entorno antes de importar los handlers
+    os.environ.update({
+        "AWS_ENDPOINT_URL": endpoint,
+        "AWS_ACCESS_KEY_ID": "loadtest",
+        "AWS_SECRET_ACCESS_KEY": "loadtest",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "TOGETHER_API_KEY": "loadtest",
+        "TOGETHER_BASE_URL": fake.base_url,
+        "DICCIONARIO_BUCKET": OUTPUT_BUCKET,
+        "DICCIONARIO_KEY": DICCIONARIO_KEY,
+        "RETRY_BACKOFF_BASE": os.environ.get("RETRY_BACKOFF_BASE", "1.0"),
+    })
+    os.environ.setdefault("IDEMPOTENCY_STORE", "archivo")
+    os.environ.setdefault("IDEMPOTENCY_DIR", tempfile.mkdtemp(prefix="loadtest-idem-"))
+    os.environ.setdefault("IDEMPOTENCY_POLL_SECONDS", "0.1")
+
+    try:
+        import boto3
+        s3 = boto3.client("s3")
+        keys = preparar_s3(s3, args.eventos, args.proporcion_fec_vec, args.texto_medicamento)
+
+        resultados = []
+        # "spawn": este proceso ya tiene hilos (servidores locales) y fork con hilos no es seguro
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=args.concurrencia, mp_context=contexto,
+                                 initializer=_init_worker) as pool:
+            # Calentar todos los workers para no mezclar el import con la latencia medida
+            list(pool.map(time.sleep, [0.05] * args.concurrencia))
+            inicio = time.perf_counter()
+            sorteo = random.Random(args.seed)
+            futures = [pool.submit(_ejecutar_evento, key, sorteo.random() < args.duplicados) for key in keys]
+            for future in as_completed(futures):
+                resultados.append(future.result())
+            duracion = time.perf_counter() - inicio
+
+        reporte = reportar(resultados, duracion, fake.stats())
+        if args.salida_json:
+            with open(args.salida_json, "w", encoding="utf-8") as f:
+                json.dump(reporte, f, indent=2, ensure_ascii=False)
+        return reporte
+    finally:
+        fake.stop()
+        if moto_server is not None:
+            moto_server.stop()
+
+
+if __name__ == "__main__":
+    main()